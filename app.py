@@ -1,18 +1,29 @@
-from fastapi import FastAPI, Request, HTTPException, UploadFile, File, Form
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi import FastAPI, Request, HTTPException, UploadFile, File, Form, Depends, Query
+from fastapi.responses import HTMLResponse, FileResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from datetime import datetime
+from urllib.parse import quote
+import asyncio
+import base64
+import errno
+import functools
+import hmac
+import time
 import os
+import re
+import shutil
+
+import orjson
+from cryptography.exceptions import UnsupportedAlgorithm
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
 
 import config
 import database
-from cleanup import start_cleanup_scheduler
-from datetime import datetime, timezone, timedelta
-
-CST = timezone(timedelta(hours=8))
+from upload_stream import StreamingUploadParser, UploadStreamError, MAX_FORM_OVERHEAD
+from cleanup import start_expiry_timers, stop_expiry_timers, schedule_expiry
 
 
 # 应用生命周期管理
@@ -21,12 +32,14 @@ async def lifespan(app: FastAPI):
     # 启动时执行
     print("🚀 正在启动 E2EE File Transfer 系统...")
     config.init_directories()
+    render_static_pages()
     await database.init_database()
-    scheduler = start_cleanup_scheduler()
+    await start_expiry_timers()
     print("✅ 系统启动完成!")
     print(f"🌐 访问地址: {config.BASE_URL}")
     yield
-    scheduler.shutdown()
+    stop_expiry_timers()
+    await database.close_database()
     print("👋 系统已关闭")
 
 
@@ -41,36 +54,58 @@ app = FastAPI(
 # 挂载静态文件目录
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# 配置模板引擎
-templates = Jinja2Templates(directory="templates")
+# 配置模板引擎（模板运行期间不变，关闭自动重载检查并缓存全部模板）
+templates = Jinja2Templates(directory="templates", auto_reload=False, cache_size=-1)
+
+# 启动时预渲染的页面，请求时直接返回字节
+URL_TOKEN_PLACEHOLDER = "__URL_TOKEN__"
+rendered_pages = {}
+
+# 接收链接前缀（BASE_URL 运行期间不变）
+_RECEIVE_PREFIX = f"{config.BASE_URL}/receive/"
+
+# 客户端提供的 upload_id 会拼进分片目录名，只允许安全字符，防止路径穿越
+_UPLOAD_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def render_static_pages():
+    """
+    预渲染页面：首页、统计页只依赖常量，接收页中的 url_token 用占位符代替，
+    请求时再做一次字节替换
+    """
+    rendered_pages["index"] = templates.get_template("index.html").render(
+        base_url=config.BASE_URL
+    ).encode()
+    rendered_pages["stats"] = templates.get_template("stats.html").render().encode()
+    for name in ("upload", "download"):
+        rendered_pages[name] = templates.get_template(f"{name}.html").render(
+            url_token=URL_TOKEN_PLACEHOLDER,
+            base_url=config.BASE_URL
+        ).encode()
 
 
 # ==================== 辅助函数 ====================
 
-async def validate_transfer_access(url_token: str, check_file: bool = False):
+async def validate_transfer_access(url_token: str, check_file: bool = False, full: bool = False):
     """
     验证传输链接的访问权限
     :param url_token: URL Token
     :param check_file: 是否检查文件是否存在
+    :param full: 是否需要公钥、加密密钥等完整字段（默认只取状态与文件信息）
     :return: transfer 记录
     :raises HTTPException: 如果验证失败
     """
-    transfer = await database.get_transfer_by_token(url_token)
+    if full:
+        transfer = await database.get_transfer_full(url_token)
+    else:
+        transfer = await database.get_transfer_meta(url_token)
 
     # 1. 检查传输记录是否存在
     if not transfer:
         raise HTTPException(status_code=404, detail="链接不存在")
 
-    # 2. 检查是否已过期
-    expires_at = datetime.fromisoformat(transfer['expires_at'])
-
-    # 确保 expires_at 是时区感知的
-    if expires_at.tzinfo is None:
-        # 如果数据库存储的是 naive datetime，假定为东八区时间
-        expires_at = expires_at.replace(tzinfo=CST)
-
-    # 使用时区感知的当前时间进行比较
-    if datetime.now(CST) > expires_at:
+    # 2. 检查是否已过期（整数时间戳比较，无需解析 ISO 时间）
+    if database.now_us() > transfer['expires_at']:
         raise HTTPException(status_code=404)
 
     # 3. 检查是否已下载（已完成传输）
@@ -83,15 +118,209 @@ async def validate_transfer_access(url_token: str, check_file: bool = False):
 
     return transfer
 
+
+def parse_public_key(public_key_pem: str) -> bytes:
+    """
+    解析并校验 PEM 格式的 RSA 公钥
+    :return: DER（SubjectPublicKeyInfo）格式公钥
+    :raises HTTPException: 公钥无法解析或不是 RSA 公钥
+    """
+    try:
+        key = serialization.load_pem_public_key(public_key_pem.encode())
+    except (ValueError, TypeError, UnsupportedAlgorithm):
+        raise HTTPException(status_code=400, detail="无效的公钥格式")
+
+    if not isinstance(key, rsa.RSAPublicKey):
+        raise HTTPException(status_code=400, detail="仅支持 RSA 公钥")
+
+    return key.public_bytes(
+        serialization.Encoding.DER,
+        serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+
+def _session_key(url_token: str, upload_id) -> str:
+    """
+    校验 upload_id 并生成分片上传会话标识
+    :raises HTTPException: upload_id 含非法字符或长度不符
+    """
+    if not isinstance(upload_id, str) or not _UPLOAD_ID_PATTERN.fullmatch(upload_id):
+        raise HTTPException(status_code=400, detail="upload_id 无效")
+    return f"{url_token}_{upload_id}"
+
+
+def _upload_path(url_token: str, filename: str):
+    """加密文件的存放路径：uploads/<token 前两位>/<token>_<文件名>"""
+    directory = config.shard_dir(config.UPLOAD_DIR, url_token)
+    directory.mkdir(exist_ok=True)
+    return directory / f"{url_token}_{os.path.basename(filename)}"
+
+
+def _remove_if_exists(file_path):
+    """删除文件，不存在时忽略"""
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+@functools.lru_cache(maxsize=None)
+def _proc_fd_dir():
+    """/proc/self/fd 的目录 fd（os.link 只有指定 dir_fd 时才会以 AT_SYMLINK_FOLLOW 调用 linkat）"""
+    return os.open("/proc/self/fd", os.O_RDONLY | os.O_DIRECTORY)
+
+
+def _write_chunk_file(chunk_dir, chunk_path, data: bytes):
+    """
+    写入单个分片：Linux 下先写入 O_TMPFILE 匿名文件，写完后再 link 到目标路径，
+    写入失败时内核自动回收，不会留下半截分片；不支持 O_TMPFILE 时直接写文件
+    """
+    fd = None
+    if hasattr(os, "O_TMPFILE"):
+        try:
+            fd = os.open(chunk_dir, os.O_TMPFILE | os.O_WRONLY, 0o600)
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EISDIR):
+                raise
+
+    if fd is None:
+        with open(chunk_path, "wb") as f:
+            f.write(data)
+        return
+
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        try:
+            os.link(str(fd), chunk_path, src_dir_fd=_proc_fd_dir())
+        except FileExistsError:
+            # 重传的分片：替换已存在的旧文件
+            os.remove(chunk_path)
+            os.link(str(fd), chunk_path, src_dir_fd=_proc_fd_dir())
+    finally:
+        os.close(fd)
+
+
+def _write_chunk(chunk_dir, chunk_path, data: bytes):
+    """
+    保存分片（在线程池中执行）
+    分片目录只在会话的第一个分片到达、目录尚不存在时创建
+    """
+    try:
+        _write_chunk_file(chunk_dir, chunk_path, data)
+    except FileNotFoundError:
+        chunk_dir.mkdir(parents=True, exist_ok=True)
+        _write_chunk_file(chunk_dir, chunk_path, data)
+
+
+def _copy_fd(src_fd: int, dst_fd: int, count: int):
+    """
+    在内核中把 src_fd 的 count 字节追加到 dst_fd
+    优先 os.copy_file_range（btrfs/xfs 上可 reflink），不支持时退回 os.sendfile
+    """
+    copy_file_range = getattr(os, "copy_file_range", None)
+    while count > 0:
+        if copy_file_range:
+            try:
+                copied = copy_file_range(src_fd, dst_fd, count)
+            except OSError:
+                copy_file_range = None
+                continue
+        else:
+            copied = os.sendfile(dst_fd, src_fd, None, count)
+        if copied == 0:
+            break
+        count -= copied
+
+
+def _merge_chunks(chunk_paths: dict, final_file_path, total_chunks: int):
+    """
+    按序合并分片到最终文件并删除分片（在线程池中执行）
+    分片只是临时文件，不单独刷盘；合并结果写入 .tmp 后只做一次 fdatasync，
+    再原子地 rename 到最终路径并刷新父目录，崩溃时不会留下半截的最终文件，也不会丢失 rename
+    :param chunk_paths: {chunk_index: chunk_path}
+    """
+    tmp_path = final_file_path.with_name(final_file_path.name + ".tmp")
+    try:
+        with open(tmp_path, "wb") as dst:
+            for i in range(total_chunks):
+                with open(chunk_paths[i], "rb") as src:
+                    _copy_fd(src.fileno(), dst.fileno(), os.fstat(src.fileno()).st_size)
+            getattr(os, "fdatasync", os.fsync)(dst.fileno())
+        os.replace(tmp_path, final_file_path)
+    except BaseException:
+        _remove_if_exists(tmp_path)
+        raise
+
+    # rename 记录在父目录中，需刷新目录本身才能保证崩溃后仍然生效
+    dir_fd = os.open(final_file_path.parent, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+    for i in range(total_chunks):
+        os.unlink(chunk_paths[i])
+
+
+def _parse_range(range_header: str, file_size: int):
+    """
+    解析单段 Range 请求头（bytes=start-end / bytes=start- / bytes=-suffix）
+    :return: (start, end) 闭区间；多段、格式无法识别或 end < start 时返回 None（忽略 Range，按整个文件响应）
+    :raises HTTPException: 范围合法但无法满足（start 超出文件大小）时返回 416
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+
+    start_str, _, end_str = spec.strip().partition("-")
+    try:
+        if start_str:
+            start = int(start_str)
+            end = int(end_str) if end_str else file_size - 1
+        else:
+            start = file_size - int(end_str)
+            end = file_size - 1
+    except ValueError:
+        return None
+
+    # 显式给出的 end < start 属于无效的 Range（RFC 9110），应忽略而不是返回 416
+    if start_str and end_str and end < start:
+        return None
+
+    start, end = max(start, 0), min(end, file_size - 1)
+    if start > end:
+        raise HTTPException(
+            status_code=416,
+            detail="请求范围无效",
+            headers={"Content-Range": f"bytes */{file_size}"}
+        )
+    return start, end
+
+
+async def _iter_file_range(file_path: str, start: int, end: int):
+    """按 DOWNLOAD_BUFFER_SIZE 读取文件的 [start, end] 区间（pread 在线程池中执行）"""
+    fd = await asyncio.to_thread(os.open, file_path, os.O_RDONLY)
+    try:
+        offset = start
+        while offset <= end:
+            data = await asyncio.to_thread(
+                os.pread, fd, min(config.DOWNLOAD_BUFFER_SIZE, end - offset + 1), offset
+            )
+            if not data:
+                break
+            offset += len(data)
+            yield data
+    finally:
+        os.close(fd)
+
 # ==================== 路由定义 ====================
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
     """首页 - 生成接收链接"""
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "base_url": config.BASE_URL
-    })
+    return HTMLResponse(content=rendered_pages["index"])
 
 
 @app.get("/health")
@@ -110,18 +339,21 @@ class CreateTransferRequest(BaseModel):
 async def create_transfer(request: CreateTransferRequest):
     """创建新的传输记录"""
     try:
-        if not request.public_key.startswith("-----BEGIN PUBLIC KEY-----"):
-            raise HTTPException(status_code=400, detail="无效的公钥格式")
+        # 创建时解析一次公钥，接收方获取时直接返回 DER
+        public_key_der = parse_public_key(request.public_key)
 
-        result = await database.create_transfer(request.public_key)
+        result = await database.create_transfer(request.public_key, public_key_der)
+        schedule_expiry(result["url_token"], result["expires_at"])
         await database.log_action(result["url_token"], "created", "生成接收链接")
 
         return {
             "success": True,
             "url_token": result["url_token"],
-            "expires_at": result["expires_at"],
-            "receive_url": f"{config.BASE_URL}/receive/{result['url_token']}"
+            "expires_at": database.us_to_iso(result["expires_at"]),
+            "receive_url": _RECEIVE_PREFIX + result['url_token']
         }
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"❌ 创建传输失败: {e}")
         raise HTTPException(status_code=500, detail="服务器错误")
@@ -131,31 +363,30 @@ async def create_transfer(request: CreateTransferRequest):
 async def get_public_key(url_token: str):
     """获取指定传输的公钥"""
     # 验证访问权限（不需要文件存在）
-    transfer = await validate_transfer_access(url_token, check_file=False)
+    transfer = await validate_transfer_access(url_token, check_file=False, full=True)
 
     # 检查是否已有文件（一个链接只能上传一次）
     if transfer['encrypted_file_path']:
         raise HTTPException(status_code=409, detail="该链接已接收过文件")
 
+    public_key_der = transfer['public_key_der']
     return {
         "public_key": transfer['public_key'],
-        "expires_at": transfer['expires_at']
+        "public_key_der": base64.b64encode(public_key_der).decode() if public_key_der else None,
+        "expires_at": database.us_to_iso(transfer['expires_at'])
     }
 
 
 @app.post("/api/upload/{url_token}")
-async def upload_file(
-        url_token: str,
-        file: UploadFile = File(...),
-        encrypted_aes_key: str = Form(...),
-        original_filename: str = Form(...)
-):
+async def upload_file(url_token: str, request: Request):
     """
     上传加密文件（兼容旧版整体上传）
+    表单字段：file、encrypted_aes_key、original_filename
     """
+    parser = None
     try:
         # 验证传输记录
-        transfer = await database.get_transfer_by_token(url_token)
+        transfer = await database.get_transfer_meta(url_token)
         if not transfer:
             raise HTTPException(status_code=404, detail="接收链接不存在")
 
@@ -163,18 +394,37 @@ async def upload_file(
         if transfer['encrypted_file_path']:
             raise HTTPException(status_code=409, detail="该链接已接收过文件")
 
-        # 检查文件大小
-        file_size = 0
-        file_path = config.UPLOAD_DIR / f"{url_token}_{file.filename}"
+        # 检查文件大小（Content-Length 已超限时不必读取请求体）
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > config.MAX_FILE_SIZE + MAX_FORM_OVERHEAD:
+            raise HTTPException(status_code=413, detail="文件超过大小限制")
+
+        # 边接收边解析，文件内容直接写入目标路径
+        try:
+            parser = StreamingUploadParser(
+                request.headers.get("content-type", ""),
+                "file",
+                lambda filename: _upload_path(url_token, filename),
+                config.MAX_FILE_SIZE
+            )
+            await parser.parse(request.stream())
+        except UploadStreamError as e:
+            raise HTTPException(status_code=400, detail=f"表单格式错误: {e}")
+
+        file_path = parser.file_path
+        file_size = parser.file_size
 
-        # 保存文件
-        with open(file_path, "wb") as buffer:
-            while chunk := await file.read(1024 * 1024):  # 1MB chunks
-                file_size += len(chunk)
-                if file_size > config.MAX_FILE_SIZE:
-                    os.remove(file_path)
-                    raise HTTPException(status_code=413, detail="文件超过大小限制")
-                buffer.write(chunk)
+        if file_size > config.MAX_FILE_SIZE:
+            raise HTTPException(status_code=413, detail="文件超过大小限制")
+
+        missing = [name for name in ("encrypted_aes_key", "original_filename") if name not in parser.fields]
+        if file_path is None:
+            missing.insert(0, "file")
+        if missing:
+            raise HTTPException(status_code=400, detail=f"缺少表单字段: {', '.join(missing)}")
+
+        encrypted_aes_key = parser.fields["encrypted_aes_key"]
+        original_filename = parser.fields["original_filename"]
 
         # 更新数据库
         success = await database.update_transfer_file(
@@ -186,7 +436,6 @@ async def upload_file(
         )
 
         if not success:
-            os.remove(file_path)
             raise HTTPException(status_code=500, detail="数据库更新失败")
 
         # 记录日志
@@ -201,17 +450,18 @@ async def upload_file(
         }
 
     except HTTPException:
+        if parser and parser.file_path:
+            await asyncio.to_thread(_remove_if_exists, parser.file_path)
         raise
     except Exception as e:
+        if parser and parser.file_path:
+            await asyncio.to_thread(_remove_if_exists, parser.file_path)
         print(f"❌ 上传失败: {e}")
         raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
 
 
 # ==================== 分块上传 API ====================
 
-upload_sessions = {}
-
-
 @app.post("/api/upload-chunk/{url_token}")
 async def upload_chunk(
         url_token: str,
@@ -227,38 +477,31 @@ async def upload_chunk(
         # 验证传输记录
         transfer = await validate_transfer_access(url_token, check_file=False)
 
-        # 初始化上传会话
-        session_key = f"{url_token}_{upload_id}"
-        if session_key not in upload_sessions:
-            upload_sessions[session_key] = {
-                "chunks": {},
-                "encrypted_aes_key": encrypted_aes_key,
-                "original_filename": original_filename,
-                "total_chunks": total_chunks
-            }
-
-        session = upload_sessions[session_key]
+        if not 0 <= chunk_index < total_chunks:
+            raise HTTPException(status_code=400, detail="分片序号无效")
 
         # 保存分片到临时文件
-        chunk_dir = config.UPLOAD_DIR / "chunks" / session_key
-        chunk_dir.mkdir(parents=True, exist_ok=True)
-
+        session_key = _session_key(url_token, upload_id)
+        chunk_dir = config.chunk_dir(session_key)
         chunk_path = chunk_dir / f"chunk_{chunk_index}"
-        with open(chunk_path, "wb") as f:
-            chunk_data = await chunk.read()
-            f.write(chunk_data)
-
-        session["chunks"][chunk_index] = str(chunk_path)
+        chunk_data = await chunk.read()
+        await asyncio.to_thread(_write_chunk, chunk_dir, chunk_path, chunk_data)
 
-        # 更新数据库进度
-        await database.update_upload_progress(url_token, len(session["chunks"]), total_chunks)
+        # 同一事务内登记会话、分片并更新进度（会话存于数据库，多 worker 共享）
+        uploaded_chunks = await database.record_upload_chunk(
+            session_key, url_token, chunk_index, str(chunk_path),
+            total_chunks, encrypted_aes_key, original_filename
+        )
+        if uploaded_chunks is None:
+            await asyncio.to_thread(os.remove, chunk_path)
+            raise HTTPException(status_code=409, detail="该链接已接收过文件")
 
         print(f"✅ 分片 {chunk_index + 1}/{total_chunks} 上传成功")
 
         return {
             "success": True,
             "chunk_index": chunk_index,
-            "uploaded_chunks": len(session["chunks"]),
+            "uploaded_chunks": uploaded_chunks,
             "total_chunks": total_chunks
         }
 
@@ -277,39 +520,33 @@ async def finalize_upload(url_token: str, request: Request):
         upload_id = body.get("upload_id")
         file_size = body.get("file_size")
 
-        session_key = f"{url_token}_{upload_id}"
+        session_key = _session_key(url_token, upload_id)
 
-        if session_key not in upload_sessions:
+        session = await database.get_upload_session(session_key)
+        if not session:
             raise HTTPException(status_code=404, detail="上传会话不存在")
 
-        session = upload_sessions[session_key]
-
         # 验证所有分片都已上传
-        if len(session["chunks"]) != session["total_chunks"]:
+        chunks = await database.get_upload_chunks(session_key)
+        if len(chunks) != session["total_chunks"]:
             raise HTTPException(
                 status_code=400,
-                detail=f"分片不完整: {len(session['chunks'])}/{session['total_chunks']}"
+                detail=f"分片不完整: {len(chunks)}/{session['total_chunks']}"
             )
 
         # 合并分片
-        final_file_path = config.UPLOAD_DIR / f"{url_token}_{session['original_filename']}"
+        final_file_path = _upload_path(url_token, session['original_filename'])
 
-        with open(final_file_path, "wb") as final_file:
-            for i in range(session["total_chunks"]):
-                chunk_path = session["chunks"][i]
-                with open(chunk_path, "rb") as chunk_file:
-                    final_file.write(chunk_file.read())
-                os.remove(chunk_path)
+        # 合并完成（已落盘并 rename 到位）后才更新数据库
+        await asyncio.to_thread(_merge_chunks, chunks, final_file_path, session["total_chunks"])
 
-        # 删除临时目录
-        chunk_dir = config.UPLOAD_DIR / "chunks" / session_key
-        if chunk_dir.exists():
-            import shutil
-            shutil.rmtree(chunk_dir)
+        # 删除临时目录（目录不存在时忽略）
+        await asyncio.to_thread(shutil.rmtree, config.chunk_dir(session_key), True)
 
-        # 更新数据库
-        success = await database.update_transfer_file(
+        # 更新数据库：写入文件信息、标记上传完成并清理会话（同一事务）
+        success = await database.complete_upload(
             url_token,
+            session_key,
             str(final_file_path),
             session["encrypted_aes_key"],
             session["original_filename"],
@@ -319,9 +556,6 @@ async def finalize_upload(url_token: str, request: Request):
         if not success:
             raise HTTPException(status_code=500, detail="数据库更新失败")
 
-        # 标记上传完成
-        await database.mark_upload_completed(url_token)
-
         # 记录日志
         await database.log_action(
             url_token,
@@ -329,9 +563,6 @@ async def finalize_upload(url_token: str, request: Request):
             f"文件: {session['original_filename']}, 大小: {file_size}, 分片数: {session['total_chunks']}"
         )
 
-        # 清理会话
-        del upload_sessions[session_key]
-
         print(f"✅ 文件上传完成: {session['original_filename']} ({file_size} bytes)")
 
         return {
@@ -357,19 +588,9 @@ async def receive_page(request: Request, url_token: str):
     # FastAPI 会自动返回标准的 JSON 错误响应
     transfer = await validate_transfer_access(url_token, check_file=False)
 
-    # 检查是否已有文件
-    if transfer['encrypted_file_path']:
-        return templates.TemplateResponse("download.html", {
-            "request": request,
-            "url_token": url_token,
-            "base_url": config.BASE_URL
-        })
-    else:
-        return templates.TemplateResponse("upload.html", {
-            "request": request,
-            "url_token": url_token,
-            "base_url": config.BASE_URL
-        })
+    # 检查是否已有文件（url_token 来自数据库记录，只含 URL 安全字符）
+    page = rendered_pages["download" if transfer['encrypted_file_path'] else "upload"]
+    return HTMLResponse(content=page.replace(URL_TOKEN_PLACEHOLDER.encode(), url_token.encode()))
 
 
 @app.get("/api/get-file-info/{url_token}")
@@ -381,24 +602,53 @@ async def get_file_info(url_token: str):
     return {
         "original_filename": transfer['original_filename'],
         "file_size": transfer['file_size'],
-        "created_at": transfer['created_at']
+        "created_at": database.us_to_iso(transfer['created_at'])
     }
 
 
 @app.get("/api/download/{url_token}")
-async def download_encrypted_file(url_token: str):
-    """下载加密文件"""
+async def download_encrypted_file(url_token: str, request: Request):
+    """下载加密文件（支持 Range 断点续传）"""
     # 验证访问权限并要求文件存在
     transfer = await validate_transfer_access(url_token, check_file=True)
 
     file_path = transfer['encrypted_file_path']
-    if not os.path.exists(file_path):
+    try:
+        stat_result = await asyncio.to_thread(os.stat, file_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="文件已被删除")
 
-    return FileResponse(
-        path=file_path,
+    filename = os.path.basename(file_path)
+    range_header = request.headers.get("range")
+    byte_range = _parse_range(range_header, stat_result.st_size) if range_header else None
+
+    if byte_range is None:
+        # 整个文件：传入 stat_result 省去一次 stat，服务器支持时由 Starlette 走 sendfile
+        return FileResponse(
+            path=file_path,
+            stat_result=stat_result,
+            media_type='application/octet-stream',
+            filename=filename,
+            headers={"Accept-Ranges": "bytes"}
+        )
+
+    start, end = byte_range
+    quoted_filename = quote(filename)
+    if quoted_filename != filename:
+        content_disposition = f"attachment; filename*=utf-8''{quoted_filename}"
+    else:
+        content_disposition = f'attachment; filename="{filename}"'
+
+    return StreamingResponse(
+        _iter_file_range(file_path, start, end),
+        status_code=206,
         media_type='application/octet-stream',
-        filename=os.path.basename(file_path)
+        headers={
+            "Accept-Ranges": "bytes",
+            "Content-Range": f"bytes {start}-{end}/{stat_result.st_size}",
+            "Content-Length": str(end - start + 1),
+            "Content-Disposition": content_disposition
+        }
     )
 
 
@@ -406,7 +656,7 @@ async def download_encrypted_file(url_token: str):
 async def get_encrypted_key(url_token: str):
     """获取加密的 AES 密钥"""
     # 验证访问权限并要求文件存在
-    transfer = await validate_transfer_access(url_token, check_file=True)
+    transfer = await validate_transfer_access(url_token, check_file=True, full=True)
 
     if not transfer['encrypted_aes_key']:
         raise HTTPException(status_code=404, detail="密钥不存在")
@@ -452,10 +702,38 @@ class StatsPasswordRequest(BaseModel):
     password: str
 
 
-@app.post("/api/verify-stats-password")
+# 统计密码尝试记录 {ip: (窗口内次数, 窗口开始时间)}
+password_attempts = {}
+
+
+async def limit_password_attempts(request: Request):
+    """
+    统计密码验证限流：每个 IP 在 STATS_PASSWORD_WINDOW 秒内最多尝试 STATS_PASSWORD_MAX_ATTEMPTS 次
+    定义为 async，在事件循环中执行（不进线程池），读改写 password_attempts 无需加锁；
+    计数保存在进程内，多 worker 时上限实际为 WORKERS × STATS_PASSWORD_MAX_ATTEMPTS
+    """
+    now = time.monotonic()
+    ip = request.client.host if request.client else "unknown"
+
+    if len(password_attempts) > 10000:
+        for key in [k for k, (_, start) in password_attempts.items() if now - start >= config.STATS_PASSWORD_WINDOW]:
+            del password_attempts[key]
+
+    count, window_start = password_attempts.get(ip, (0, now))
+    if now - window_start >= config.STATS_PASSWORD_WINDOW:
+        count, window_start = 0, now
+
+    if count >= config.STATS_PASSWORD_MAX_ATTEMPTS:
+        raise HTTPException(status_code=429, detail="尝试次数过多，请稍后再试")
+
+    password_attempts[ip] = (count + 1, window_start)
+
+
+@app.post("/api/verify-stats-password", dependencies=[Depends(limit_password_attempts)])
 async def verify_stats_password(request: StatsPasswordRequest):
     """验证统计页面密码"""
-    if request.password == config.STATS_PASSWORD:
+    # 常量时间比较，避免计时攻击
+    if hmac.compare_digest(request.password.encode(), config.STATS_PASSWORD.encode()):
         return {"success": True}
     else:
         return {"success": False}
@@ -464,9 +742,7 @@ async def verify_stats_password(request: StatsPasswordRequest):
 @app.get("/stats", response_class=HTMLResponse)
 async def stats_page(request: Request):
     """统计页面（需要密码验证）"""
-    return templates.TemplateResponse("stats.html", {
-        "request": request
-    })
+    return HTMLResponse(content=rendered_pages["stats"])
 
 
 @app.get("/api/statistics")
@@ -476,35 +752,39 @@ async def get_statistics():
     return stats
 
 
+def _log_to_json(row) -> dict:
+    """日志记录转换为 API 输出格式（时间转为 ISO 字符串）"""
+    log = dict(row)
+    log["created_at"] = database.us_to_iso(log["created_at"])
+    return log
+
+
 @app.get("/api/recent-logs")
-async def get_recent_logs(limit: int = 20):
-    """获取最近的日志记录"""
-    import aiosqlite
-    async with aiosqlite.connect(database.DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("""
-            SELECT * FROM transfer_logs
-            ORDER BY created_at DESC
-            LIMIT ?
-        """, (limit,)) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+async def get_recent_logs(limit: int = Query(20, ge=1, le=1000)):
+    """获取最近的日志记录（orjson 序列化）"""
+    # 先一次性读完再响应，不在慢客户端接收期间占用只读连接（及其读快照）
+    logs = await database.get_recent_logs(limit)
+    return Response(orjson.dumps([_log_to_json(log) for log in logs]), media_type="application/json")
 
 
 @app.get("/api/transfer-logs/{url_token}")
 async def get_transfer_logs(url_token: str):
     """获取特定传输的日志"""
     logs = await database.get_transfer_logs(url_token)
-    return logs
+    return [_log_to_json(log) for log in logs]
 
 
 # ==================== 启动命令 ====================
 if __name__ == "__main__":
+    import sys
     import uvicorn
 
     uvicorn.run(
         "app:app",
         host="0.0.0.0",
         port=8000,
-        reload=True  # 开发模式热重载
+        loop="asyncio" if sys.platform == "win32" else "uvloop",  # uvloop 不支持 Windows
+        http="httptools",
+        workers=1 if config.DEBUG else config.WORKERS,
+        reload=config.DEBUG  # 开发模式热重载（与多 worker 互斥）
     )
\ No newline at end of file
@@ -1,25 +1,47 @@
 import asyncio
 import os
+import shutil
+import time
 from pathlib import Path
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from database import get_expired_transfers, delete_transfer
+from typing import Dict, Optional
+import config
+from database import (reap_expired, delete_transfer, get_transfer_meta,
+                      get_transfer_expiries, reap_expired_upload_sessions,
+                      delete_upload_sessions_by_token)
 from datetime import datetime, timezone, timedelta
 
 CST = timezone(timedelta(hours=8))
 
+# 每个传输的到期定时器 {url_token: TimerHandle}
+_expiry_timers: Dict[str, asyncio.TimerHandle] = {}
+# 正在执行的清理任务（保持引用，避免被回收）
+_expiry_tasks: set = set()
+
+
+def _safe_chunk_dir(session_key: str) -> Optional[Path]:
+    """
+    分片上传会话的临时目录（已解析为绝对路径）
+    :return: 目录路径；解析后不在 CHUNK_DIR 之下时返回 None（拒绝删除，防止路径穿越）
+    """
+    chunk_dir = config.chunk_dir(session_key).resolve()
+    if config.CHUNK_DIR.resolve() not in chunk_dir.parents:
+        print(f"   ❌ 拒绝删除分片目录之外的路径: {chunk_dir}")
+        return None
+    return chunk_dir
+
 
 async def cleanup_expired_files():
-    """清理过期或已下载的文件"""
+    """清理已到期的传输文件和过期的分片上传会话"""
     current_time = datetime.now(CST).strftime('%Y-%m-%d %H:%M:%S')
     print(f"🧹 开始清理过期文件... (东八区时间: {current_time})")
 
-    expired_transfers = await get_expired_transfers()
-    cleaned_count = 0
+    # 一次性删除数据库记录，再删除对应文件
+    expired_transfers = await reap_expired()
+    cleaned_count = len(expired_transfers)
 
-    for transfer in expired_transfers:
-        # 删除文件
-        if transfer['encrypted_file_path']:
-            file_path = Path(transfer['encrypted_file_path'])
+    for _, encrypted_file_path in expired_transfers:
+        if encrypted_file_path:
+            file_path = Path(encrypted_file_path)
             if file_path.exists():
                 try:
                     os.remove(file_path)
@@ -27,9 +49,18 @@ async def cleanup_expired_files():
                 except Exception as e:
                     print(f"   ❌ 删除失败: {e}")
 
-        # 删除数据库记录
-        await delete_transfer(transfer['url_token'])
-        cleaned_count += 1
+    # 清理未完成的过期分片上传会话
+    expired_sessions = await reap_expired_upload_sessions()
+    cleaned_count += len(expired_sessions)
+
+    for session_key in expired_sessions:
+        chunk_dir = _safe_chunk_dir(session_key)
+        if chunk_dir and chunk_dir.exists():
+            try:
+                shutil.rmtree(chunk_dir)
+                print(f"   ✅ 删除分片目录: {chunk_dir.name}")
+            except Exception as e:
+                print(f"   ❌ 删除失败: {e}")
 
     if cleaned_count > 0:
         print(f"🎉 清理完成，共删除 {cleaned_count} 条记录")
@@ -37,10 +68,63 @@ async def cleanup_expired_files():
         print("✅ 无需清理")
 
 
-def start_cleanup_scheduler():
-    """启动定时清理任务(每小时执行一次)"""
-    scheduler = AsyncIOScheduler()
-    scheduler.add_job(cleanup_expired_files, 'interval', hours=1)
-    scheduler.start()
-    print("⏰ 定时清理任务已启动(每小时执行)")
-    return scheduler
\ No newline at end of file
+async def expire_transfer(url_token: str):
+    """到期清理单个传输：删除加密文件、分片目录和数据库记录"""
+    _expiry_timers.pop(url_token, None)
+
+    transfer = await get_transfer_meta(url_token)
+    if transfer and transfer['encrypted_file_path']:
+        file_path = Path(transfer['encrypted_file_path'])
+        try:
+            await asyncio.to_thread(os.remove, file_path)
+            print(f"   ✅ 删除文件: {file_path.name}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"   ❌ 删除失败: {e}")
+
+    for session_key in await delete_upload_sessions_by_token(url_token):
+        chunk_dir = _safe_chunk_dir(session_key)
+        if chunk_dir:
+            await asyncio.to_thread(shutil.rmtree, chunk_dir, True)
+
+    if await delete_transfer(url_token):
+        print(f"🧹 传输已到期清理: {url_token}")
+
+
+def _run_expiry(url_token: str):
+    task = asyncio.create_task(expire_transfer(url_token))
+    _expiry_tasks.add(task)
+    task.add_done_callback(_expiry_tasks.discard)
+
+
+def schedule_expiry(url_token: str, expires_at: int):
+    """
+    在传输到期的时刻触发清理（替代定时轮询）
+    :param expires_at: 到期时间（Unix 微秒）
+    """
+    cancel_expiry(url_token)
+    delay = max(0.0, expires_at / 1_000_000 - time.time())
+    _expiry_timers[url_token] = asyncio.get_running_loop().call_later(delay, _run_expiry, url_token)
+
+
+def cancel_expiry(url_token: str):
+    """取消传输的到期定时器"""
+    timer = _expiry_timers.pop(url_token, None)
+    if timer:
+        timer.cancel()
+
+
+async def start_expiry_timers():
+    """启动时先清理一次已过期的记录，再为其余传输恢复到期定时器"""
+    await cleanup_expired_files()
+    for url_token, expires_at in await get_transfer_expiries():
+        schedule_expiry(url_token, expires_at)
+    print(f"⏰ 到期清理定时器已就绪({len(_expiry_timers)} 个传输)")
+
+
+def stop_expiry_timers():
+    """取消所有到期定时器"""
+    for timer in _expiry_timers.values():
+        timer.cancel()
+    _expiry_timers.clear()
@@ -7,24 +7,49 @@ BASE_DIR = Path(__file__).resolve().parent
 # 数据库配置
 DATABASE_DIR = BASE_DIR / "data"
 DATABASE_PATH = DATABASE_DIR / "database.db"
+DB_PAGE_SIZE = 8192  # 新建数据库的页大小（只在建库时生效，已有数据库不变）
+DB_CACHED_STATEMENTS = 256  # 每个连接缓存的预编译语句数（sqlite3 默认 128）
+DB_READ_POOL_SIZE = min(4, os.cpu_count() or 1)  # 每个 worker 的只读连接数（WAL 下可与写连接并发）
 
 # 文件存储配置
 UPLOAD_DIR = BASE_DIR / "uploads"
+CHUNK_DIR = UPLOAD_DIR / "chunks"  # 分片临时目录
 MAX_FILE_SIZE = 5 * 1024 * 1024 * 1024  # 5GB (优化后支持大文件)
 
 # 分块上传配置
 CHUNK_SIZE = 5 * 1024 * 1024  # 5MB per chunk (用于分块加密和上传)
 UPLOAD_BUFFER_SIZE = 1024 * 1024  # 1MB (读取缓冲区)
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024  # 1MB (Range 下载读取缓冲区)
+PROGRESS_FLUSH_INTERVAL = 0.5  # 分片上传进度合并写回数据库的间隔(秒)
+
+# 日志批量写入配置
+LOG_BATCH_SIZE = 64  # 每批最多写入条数（攒满立即写入）
+LOG_FLUSH_INTERVAL = 0.1  # 攒批最长等待时间(秒)
+
+# 数据库维护配置
+DB_OPTIMIZE_INTERVAL = 15 * 60  # 定期执行 PRAGMA optimize 的间隔(秒)
+
+# 传输记录缓存配置（进程内，写操作后立即失效）
+TOKEN_CACHE_TTL = 2.0  # 缓存有效期(秒)
+TOKEN_CACHE_MAX_SIZE = 10000  # 最大缓存条数
 
 # 文件有效期(小时)
 FILE_EXPIRATION_HOURS = 24
 
+# 运行配置
+DEBUG = os.getenv("DEBUG", "").lower() in ("1", "true", "yes")  # 开发模式：单 worker + 热重载
+WORKERS = int(os.getenv("WORKERS", os.cpu_count() or 1))  # 生产环境 worker 进程数
+
 # URL 配置
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
 URL_TOKEN_LENGTH = 16  # 接收码长度
+TOKEN_POOL_SIZE = 1024  # 预生成 Token 池容量
+TOKEN_POOL_LOW_WATERMARK = 256  # 低于该数量时后台补满
 
 # 安全配置
 STATS_PASSWORD = os.getenv("STATS_PASSWORD", "admin123")  # 统计页面密码（建议通过环境变量设置）
+STATS_PASSWORD_MAX_ATTEMPTS = 5  # 每个 IP 在窗口期内最多尝试次数
+STATS_PASSWORD_WINDOW = 60  # 限流窗口(秒)
 ALLOWED_EXTENSIONS = {
     # 文档类
     'pdf', 'doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx', 'txt', 'md',
@@ -38,13 +63,23 @@ ALLOWED_EXTENSIONS = {
     'json', 'xml', 'csv', 'sql'
 }
 
+def shard_dir(base: Path, url_token: str) -> Path:
+    """按 Token 前两个字符分桶，避免单个目录下文件过多"""
+    return base / url_token[:2]
+
+
+def chunk_dir(session_key: str) -> Path:
+    """分片上传会话的临时目录（session_key 以 url_token 开头）"""
+    return shard_dir(CHUNK_DIR, session_key) / session_key
+
+
 # 创建必要的目录
 def init_directories():
     """初始化项目所需目录"""
     DATABASE_DIR.mkdir(exist_ok=True)
     UPLOAD_DIR.mkdir(exist_ok=True)
-    (UPLOAD_DIR / "chunks").mkdir(exist_ok=True)  # 分片临时目录
+    CHUNK_DIR.mkdir(exist_ok=True)
     print(f"✅ 目录初始化完成:")
     print(f"   - 数据库目录: {DATABASE_DIR}")
     print(f"   - 上传目录: {UPLOAD_DIR}")
-    print(f"   - 分片目录: {UPLOAD_DIR / 'chunks'}")
\ No newline at end of file
+    print(f"   - 分片目录: {CHUNK_DIR}")
\ No newline at end of file
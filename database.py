@@ -1,37 +1,235 @@
 import aiosqlite
+import asyncio
+import itertools
 import secrets
-from datetime import datetime, timedelta
-from typing import Optional, Dict
-from config import DATABASE_PATH, FILE_EXPIRATION_HOURS, URL_TOKEN_LENGTH
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict
+from config import (DATABASE_PATH, FILE_EXPIRATION_HOURS, URL_TOKEN_LENGTH,
+                    LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL, TOKEN_CACHE_TTL, TOKEN_CACHE_MAX_SIZE,
+                    TOKEN_POOL_SIZE, TOKEN_POOL_LOW_WATERMARK, DB_OPTIMIZE_INTERVAL, DB_CACHED_STATEMENTS,
+                    DB_READ_POOL_SIZE, DB_PAGE_SIZE, PROGRESS_FLUSH_INTERVAL)
 
 # 定义东八区时区
 CST = timezone(timedelta(hours=8))
 
+# 库中时间统一存储为整数 Unix 微秒，只在 API 边界转换为 ISO 字符串
+_EXPIRATION_US = FILE_EXPIRATION_HOURS * 3600 * 1_000_000
+# 当前数据库结构版本（PRAGMA user_version）：1 = 时间列改为 Unix 微秒
+SCHEMA_VERSION = 1
+# 各表以 Unix 微秒存储的时间列（用于旧库升级）
+TIMESTAMP_COLUMNS = {
+    "transfers": ("created_at", "expires_at", "download_at", "upload_started_at", "upload_completed_at"),
+    "transfer_logs": ("created_at",),
+    "upload_sessions": ("created_at", "expires_at"),
+}
+
+# 每个连接打开后都要设置的 PRAGMA（均为连接级设置）
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",  # WAL 下只在检查点时 fsync
+    "PRAGMA mmap_size=268435456",  # 256MB 内存映射读
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",  # 64MB 页缓存
+    "PRAGMA busy_timeout=5000",
+)
+
+# 传输表结构：所有查询都按 url_token 访问，以其为主键（不再需要单独的自增 id）
+# 每行含 PEM/DER 公钥、加密密钥与路径，约 1KB 以上，远超 WITHOUT ROWID 适用的行大小，
+# 因此保持普通 rowid 表：表 B-tree 内部节点只存 rowid，扇出不受行大小影响
+TRANSFERS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        url_token TEXT PRIMARY KEY NOT NULL,
+        public_key TEXT NOT NULL,
+        public_key_der BLOB,
+        encrypted_file_path TEXT,
+        encrypted_aes_key TEXT,
+        original_filename TEXT,
+        file_size INTEGER DEFAULT 0,
+        created_at INTEGER NOT NULL,
+        expires_at INTEGER NOT NULL,
+        downloaded BOOLEAN DEFAULT 0,
+        download_at INTEGER,
+        upload_started_at INTEGER,
+        upload_completed_at INTEGER,
+        chunks_total INTEGER DEFAULT 0,
+        chunks_uploaded INTEGER DEFAULT 0
+    )
+"""
+
+# 热路径语句（每次请求/每个分片都会执行）：统一定义为模块常量，
+# 每次传入同一个字符串，保证命中连接的预编译语句缓存
+# 大部分请求只需校验状态与文件信息：不取出公钥、加密密钥等大字段
+_TRANSFER_META_COLUMNS = (
+    "url_token, encrypted_file_path, original_filename, file_size, "
+    "created_at, expires_at, downloaded"
+)
+_SQL_SELECT_TRANSFER_META = f"SELECT {_TRANSFER_META_COLUMNS} FROM transfers WHERE url_token = ?"
+_SQL_SELECT_TRANSFER_FULL = (
+    f"SELECT {_TRANSFER_META_COLUMNS}, public_key, public_key_der, encrypted_aes_key "
+    "FROM transfers WHERE url_token = ?"
+)
+_SQL_INSERT_TRANSFER = """
+    INSERT INTO transfers (url_token, public_key, public_key_der, expires_at, created_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(url_token) DO NOTHING
+    RETURNING url_token
+"""
+_SQL_INSERT_UPLOAD_SESSION = """
+    INSERT OR IGNORE INTO upload_sessions
+        (session_key, url_token, encrypted_aes_key, original_filename, total_chunks, created_at, expires_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+_SQL_UPSERT_UPLOAD_CHUNK = """
+    INSERT OR REPLACE INTO upload_chunks (session_key, chunk_index, chunk_path)
+    VALUES (?, ?, ?)
+"""
+_SQL_SELECT_UPLOADABLE = """
+    SELECT 1 FROM transfers
+    WHERE url_token = ?
+    AND downloaded = 0
+    AND encrypted_file_path IS NULL
+"""
+_SQL_COUNT_UPLOAD_CHUNKS = "SELECT COUNT(*) FROM upload_chunks WHERE session_key = ?"
+# 上传进度只是展示用的软状态：由 _progress_flusher 合并后批量写回，上传完成后不再覆盖
+_SQL_UPDATE_UPLOAD_PROGRESS = """
+    UPDATE transfers
+    SET chunks_uploaded = ?,
+        chunks_total = ?,
+        upload_started_at = COALESCE(upload_started_at, ?)
+    WHERE url_token = ?
+    AND upload_completed_at IS NULL
+"""
+_SQL_INSERT_LOG = """
+    INSERT INTO transfer_logs (url_token, action, details, ip_address, user_agent, created_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# 共享的写连接（通过 get_db 获取；以下依赖事件循环的对象都在 init_database 中创建）
+_db: Optional[aiosqlite.Connection] = None
+# 只读连接池：每个连接有自己的线程，读查询不必排在写连接后面（轮询使用）
+_read_dbs: list = []
+_read_db_cycle = None
+# SQLite 同一时刻只允许一个写事务，共享连接上的写操作需串行
+_write_lock: Optional[asyncio.Lock] = None
+# 待写入的日志（由后台任务批量落库）
+_log_queue: Optional[asyncio.Queue] = None
+# 队列攒满一批时唤醒写入任务，不必等到 LOG_FLUSH_INTERVAL
+_log_batch_ready: Optional[asyncio.Event] = None
+_log_writer_task: Optional[asyncio.Task] = None
+# 预生成的 URL Token 池（后台任务补充），创建传输时直接取用
+_token_pool: asyncio.Queue = asyncio.Queue(maxsize=TOKEN_POOL_SIZE)
+_token_refill_task: Optional[asyncio.Task] = None
+# 定期更新查询规划器统计信息的后台任务
+_optimize_task: Optional[asyncio.Task] = None
+# 尚未写回的分片上传进度 {url_token: (已上传分片数, 分片总数, 首个分片时间)}
+_pending_progress: Dict[str, tuple] = {}
+_progress_task: Optional[asyncio.Task] = None
+# get_transfer_meta 的进程内缓存 {url_token: (缓存时间, 记录)}，写操作后失效
+_token_cache: Dict[str, tuple] = {}
+# 缓存失效序号：读连接与写连接并发，读到旧快照的查询可能在写操作失效缓存之后才返回，
+# 读之前记下 _invalidation_seq，只有期间该 Token 未被失效时才写入缓存
+_invalidation_seq = 0
+# {url_token: 最近一次失效时的序号}，过多时清空并把 _invalidation_floor 提到当前序号
+_token_invalidated_at: Dict[str, int] = {}
+_invalidation_floor = 0
+
+def now_us() -> int:
+    """当前时间（Unix 微秒）"""
+    return time.time_ns() // 1000
+
+
+def us_to_iso(timestamp_us: Optional[int]) -> Optional[str]:
+    """Unix 微秒 → 东八区 ISO 格式字符串（None 原样返回）"""
+    if timestamp_us is None:
+        return None
+    seconds, micros = divmod(timestamp_us, 1_000_000)
+    return datetime.fromtimestamp(seconds, CST).replace(microsecond=micros).isoformat()
+
+
+async def _open_connection() -> aiosqlite.Connection:
+    """打开连接并应用 CONNECTION_PRAGMAS"""
+    db = await aiosqlite.connect(DATABASE_PATH, cached_statements=DB_CACHED_STATEMENTS)
+    for pragma in CONNECTION_PRAGMAS:
+        await db.execute(pragma)
+    return db
+
+
+@asynccontextmanager
+async def connect():
+    """短连接：async with connect() as db（仅用于初始化建表）"""
+    db = await _open_connection()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+async def _open_read_connection() -> aiosqlite.Connection:
+    """打开只读连接（mode=ro + query_only），应用 CONNECTION_PRAGMAS"""
+    db = await aiosqlite.connect(f"{DATABASE_PATH.as_uri()}?mode=ro", uri=True,
+                                 cached_statements=DB_CACHED_STATEMENTS)
+    for pragma in CONNECTION_PRAGMAS:
+        await db.execute(pragma)
+    await db.execute("PRAGMA query_only=1")
+    db.row_factory = aiosqlite.Row
+    return db
+
+
+def get_read_db() -> aiosqlite.Connection:
+    """轮询取一个只读连接（init_database 之后可用）"""
+    return next(_read_db_cycle)
+
+
+async def get_db() -> aiosqlite.Connection:
+    """
+    获取共享写连接（首次调用时创建）
+    写操作通过 _write_transaction 串行执行；热点读查询走 get_read_db 的只读连接
+    """
+    global _db
+    if _db is None:
+        _db = await _open_connection()
+        _db.row_factory = aiosqlite.Row
+    return _db
+
+
+@asynccontextmanager
+async def _write_transaction():
+    """在写锁内执行写操作：正常结束时提交，出错时回滚"""
+    db = await get_db()
+    async with _write_lock:
+        try:
+            yield db
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+
+
 # 数据库初始化
 async def init_database():
-    """创建数据库表结构"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    """创建数据库表结构，打开共享连接并启动后台任务（日志写入、Token 池补充、定期优化）"""
+    global _write_lock, _log_queue, _log_batch_ready, _log_writer_task, _token_refill_task, _optimize_task
+    global _read_db_cycle, _progress_task
+
+    async with connect() as db:
+        # 新建的空数据库：页大小必须在建表前、切换 WAL 前设置，之后无法再修改
+        async with db.execute("SELECT count(*) FROM sqlite_master") as cursor:
+            if (await cursor.fetchone())[0] == 0:
+                await db.execute(f"PRAGMA page_size={DB_PAGE_SIZE}")
+
+        # WAL 模式：读写互不阻塞（持久化设置，只需执行一次；不能在事务内切换）
+        await db.execute("PRAGMA journal_mode=WAL")
+
+        # 建表、旧库升级与建索引放在同一个事务内，一次提交
+        await db.execute("BEGIN")
+
         # 传输表
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS transfers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                url_token TEXT UNIQUE NOT NULL,
-                public_key TEXT NOT NULL,
-                encrypted_file_path TEXT,
-                encrypted_aes_key TEXT,
-                original_filename TEXT,
-                file_size INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                expires_at TIMESTAMP NOT NULL,
-                downloaded BOOLEAN DEFAULT 0,
-                download_at TIMESTAMP,
-                upload_started_at TIMESTAMP,
-                upload_completed_at TIMESTAMP,
-                chunks_total INTEGER DEFAULT 0,
-                chunks_uploaded INTEGER DEFAULT 0
-            )
-        """)
+        await db.execute(TRANSFERS_TABLE_SQL.format(name="transfers"))
+
+        # 旧库升级：补充新增的列
+        await _ensure_column(db, "transfers", "public_key_der", "BLOB")
+        await _migrate_transfers_primary_key(db)
 
         # 日志表
         await db.execute("""
@@ -42,13 +240,181 @@ async def init_database():
                 details TEXT,
                 ip_address TEXT,
                 user_agent TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at INTEGER NOT NULL
             )
         """)
 
+        # 分片上传会话表（多 worker 共享，替代进程内字典）
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS upload_sessions (
+                session_key TEXT PRIMARY KEY,
+                url_token TEXT NOT NULL,
+                encrypted_aes_key TEXT NOT NULL,
+                original_filename TEXT NOT NULL,
+                total_chunks INTEGER NOT NULL,
+                created_at INTEGER NOT NULL,
+                expires_at INTEGER NOT NULL
+            )
+        """)
+
+        # 已上传分片表
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS upload_chunks (
+                session_key TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                chunk_path TEXT NOT NULL,
+                PRIMARY KEY (session_key, chunk_index)
+            )
+        """)
+
+        await _migrate_integer_timestamps(db)
+
+        # 索引：过期清理与日志查询（url_token 是 transfers 的主键，无需另建）
+        # 到期清理不区分是否已下载，旧的部分索引（downloaded = 0）无法使用，换成完整索引
+        await db.execute("DROP INDEX IF EXISTS idx_transfers_expires")
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_transfers_expires_at ON transfers(expires_at)
+        """)
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_logs_token_time ON transfer_logs(url_token, created_at DESC)
+        """)
+        # 统计改为单次条件聚合（全表扫描）后不再使用的索引：只会增加写入开销
+        for index in ("idx_transfers_downloaded", "idx_transfers_created_date", "idx_transfers_download_date"):
+            await db.execute(f"DROP INDEX IF EXISTS {index}")
+        # 分片上传会话：按传输到期清理（url_token）与过期会话清理（expires_at）
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_upload_sessions_token ON upload_sessions(url_token)
+        """)
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_upload_sessions_expires ON upload_sessions(expires_at)
+        """)
+
         await db.commit()
         print("✅ 数据库表初始化完成")
 
+    await get_db()
+    _read_dbs[:] = [await _open_read_connection() for _ in range(DB_READ_POOL_SIZE)]
+    _read_db_cycle = itertools.cycle(_read_dbs)
+    _write_lock = asyncio.Lock()
+    _log_queue = asyncio.Queue()
+    _log_batch_ready = asyncio.Event()
+    _log_writer_task = asyncio.create_task(_log_writer())
+    _fill_token_pool()
+    _token_refill_task = asyncio.create_task(_token_refiller())
+    _optimize_task = asyncio.create_task(_optimizer())
+    _progress_task = asyncio.create_task(_progress_flusher())
+
+
+async def _ensure_column(db: aiosqlite.Connection, table: str, column: str, definition: str):
+    """
+    列不存在时通过 ALTER TABLE 补充（用于升级旧数据库）
+    :return: 是否新增了该列
+    """
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    if column in columns:
+        return False
+    await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
+
+async def _migrate_transfers_primary_key(db: aiosqlite.Connection):
+    """
+    旧库升级：把带自增 id 的 transfers 表，或曾经建成 WITHOUT ROWID 的 transfers 表，
+    重建为以 url_token 为主键的普通 rowid 表
+    """
+    async with db.execute("PRAGMA table_info(transfers)") as cursor:
+        columns = [row[1] for row in await cursor.fetchall()]
+    async with db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'transfers'") as cursor:
+        without_rowid = "WITHOUT ROWID" in (await cursor.fetchone())[0].upper()
+    if "id" not in columns and not without_rowid:
+        return
+
+    # SAVEPOINT 在事务内外都可用，保证重建要么全部完成，要么完全不生效
+    await db.execute("SAVEPOINT migrate_transfers")
+    await db.execute("DROP TABLE IF EXISTS transfers_new")
+    await db.execute(TRANSFERS_TABLE_SQL.format(name="transfers_new"))
+    async with db.execute("PRAGMA table_info(transfers_new)") as cursor:
+        new_columns = {row[1] for row in await cursor.fetchall()}
+    column_list = ", ".join(column for column in columns if column in new_columns)
+    await db.execute(f"INSERT INTO transfers_new ({column_list}) SELECT {column_list} FROM transfers")
+    await db.execute("DROP TABLE transfers")
+    await db.execute("ALTER TABLE transfers_new RENAME TO transfers")
+    await db.execute("RELEASE migrate_transfers")
+    print("✅ transfers 表已重建为以 url_token 为主键的 rowid 表")
+
+
+async def _migrate_integer_timestamps(db: aiosqlite.Connection):
+    """
+    旧库升级（结构版本 0 → 1）：把 ISO 字符串 / CURRENT_TIMESTAMP 格式的时间转换为 Unix 微秒，
+    并删除已被 expires_at 取代的 expires_at_ts 列
+    """
+    async with db.execute("PRAGMA user_version") as cursor:
+        if (await cursor.fetchone())[0] >= SCHEMA_VERSION:
+            return
+
+    for table, columns in TIMESTAMP_COLUMNS.items():
+        for column in columns:
+            # julianday 可解析带时区后缀的 ISO 字符串，不带时区的按 UTC 处理（即 CURRENT_TIMESTAMP）
+            await db.execute(f"""
+                UPDATE {table}
+                SET {column} = CAST(ROUND((julianday({column}) - 2440587.5) * 86400000000) AS INTEGER)
+                WHERE typeof({column}) = 'text'
+            """)
+
+    async with db.execute("PRAGMA table_info(transfers)") as cursor:
+        if "expires_at_ts" in {row[1] for row in await cursor.fetchall()}:
+            await db.execute("ALTER TABLE transfers DROP COLUMN expires_at_ts")
+
+    await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+async def close_database():
+    """停止后台任务（写完剩余日志）并关闭共享连接"""
+    global _db, _log_writer_task, _token_refill_task, _optimize_task, _progress_task
+    for task in (_token_refill_task, _optimize_task, _progress_task):
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    _token_refill_task = None
+    _optimize_task = None
+    _progress_task = None
+    await _flush_progress()
+
+    if _log_writer_task is not None:
+        _log_queue.put_nowait(None)  # 停止信号，写入任务会先落库再退出
+        _log_batch_ready.set()
+        await _log_writer_task
+        _log_writer_task = None
+
+    for db in _read_dbs:
+        await db.close()
+    _read_dbs.clear()
+
+    if _db is not None:
+        await _optimize()  # SQLite 建议关闭连接前执行一次
+        await _db.close()
+        _db = None
+
+
+async def _optimize():
+    """执行 PRAGMA optimize（必要时会 ANALYZE，属于写操作）"""
+    try:
+        async with _write_transaction() as db:
+            await db.execute("PRAGMA optimize")
+    except Exception as e:
+        print(f"❌ PRAGMA optimize 失败: {e}")
+
+
+async def _optimizer():
+    """后台任务：每 DB_OPTIMIZE_INTERVAL 秒执行一次 PRAGMA optimize"""
+    while True:
+        await asyncio.sleep(DB_OPTIMIZE_INTERVAL)
+        await _optimize()
+
 
 # 生成唯一的 URL Token
 def generate_url_token() -> str:
@@ -56,47 +422,109 @@ def generate_url_token() -> str:
     return secrets.token_urlsafe(URL_TOKEN_LENGTH)
 
 
+def _fill_token_pool():
+    """把 Token 池补满"""
+    while not _token_pool.full():
+        _token_pool.put_nowait(generate_url_token())
+
+
+async def _token_refiller():
+    """后台任务：Token 池低于水位线时补满"""
+    while True:
+        if _token_pool.qsize() < TOKEN_POOL_LOW_WATERMARK:
+            _fill_token_pool()
+        await asyncio.sleep(1)
+
+
+def _take_url_token() -> str:
+    """从 Token 池取一个 Token，池空时现场生成"""
+    try:
+        return _token_pool.get_nowait()
+    except asyncio.QueueEmpty:
+        return generate_url_token()
+
+
 # 创建新的传输记录
-async def create_transfer(public_key: str) -> Dict:
+async def create_transfer(public_key: str, public_key_der: bytes) -> Dict:
     """
     创建新传输记录
     :param public_key: PEM 格式的公钥
-    :return: 包含 url_token 的字典
+    :param public_key_der: 解析后的 DER（SubjectPublicKeyInfo）格式公钥
+    :return: 包含 url_token、expires_at（Unix 微秒）的字典
     """
-    url_token = generate_url_token()
-    # 使用东八区时间
-    now = datetime.now(CST)
-    expires_at = now + timedelta(hours=FILE_EXPIRATION_HOURS)
-
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("""
-            INSERT INTO transfers (url_token, public_key, expires_at, created_at)
-            VALUES (?, ?, ?, ?)
-        """, (url_token, public_key, expires_at.isoformat(), now.isoformat()))
-        await db.commit()
+    now = now_us()
+    expires_at = now + _EXPIRATION_US
+
+    async with _write_transaction() as db:
+        for attempt in range(3):
+            url_token = _take_url_token()
+            async with db.execute(_SQL_INSERT_TRANSFER, (
+                url_token, public_key, public_key_der, expires_at, now
+            )) as cursor:
+                if await cursor.fetchone():
+                    break
+            # Token 冲突（概率极低）：未插入任何行，换一个重试
+        else:
+            raise aiosqlite.IntegrityError("生成唯一 URL Token 失败")
 
     return {
         "url_token": url_token,
-        "expires_at": expires_at.isoformat()
+        "expires_at": expires_at
     }
 
 
 # 根据 Token 获取传输记录
-async def get_transfer_by_token(url_token: str) -> Optional[Dict]:
+async def get_transfer_meta(url_token: str) -> Optional[aiosqlite.Row]:
     """
-    通过 URL Token 获取传输信息
+    通过 URL Token 获取传输的状态与文件信息（热路径，不含公钥和加密密钥）
     :param url_token: 接收码
-    :return: 传输记录字典或 None
+    :return: 传输记录（aiosqlite.Row，按列名取值，只读）或 None
     """
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("""
-            SELECT * FROM transfers WHERE url_token = ?
-        """, (url_token,)) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return dict(row)
-    return None
+    now = time.monotonic()
+    cached = _token_cache.get(url_token)
+    if cached and now - cached[0] < TOKEN_CACHE_TTL:
+        return cached[1]
+
+    read_seq = _invalidation_seq
+    db = get_read_db()
+    async with db.execute(_SQL_SELECT_TRANSFER_META, (url_token,)) as cursor:
+        row = await cursor.fetchone()
+    if row and read_seq >= _invalidation_floor and _token_invalidated_at.get(url_token, -1) <= read_seq:
+        if len(_token_cache) >= TOKEN_CACHE_MAX_SIZE:
+            _prune_token_cache(now)
+        _token_cache[url_token] = (now, row)
+    return row
+
+
+async def get_transfer_full(url_token: str) -> Optional[aiosqlite.Row]:
+    """
+    通过 URL Token 获取完整传输信息（含公钥和加密的 AES 密钥，仅密钥相关接口使用，不缓存）
+    :param url_token: 接收码
+    :return: 传输记录（aiosqlite.Row）或 None
+    """
+    db = get_read_db()
+    async with db.execute(_SQL_SELECT_TRANSFER_FULL, (url_token,)) as cursor:
+        return await cursor.fetchone()
+
+
+def _invalidate_transfer(url_token: str):
+    """写操作提交后调用：删除缓存项并记录失效序号，阻止并发中的旧读结果回填缓存"""
+    global _invalidation_seq, _invalidation_floor
+    _token_cache.pop(url_token, None)
+    _invalidation_seq += 1
+    if len(_token_invalidated_at) >= TOKEN_CACHE_MAX_SIZE:
+        # 清空后无法判断更早开始的读，一律不回填
+        _token_invalidated_at.clear()
+        _invalidation_floor = _invalidation_seq
+    _token_invalidated_at[url_token] = _invalidation_seq
+
+
+def _prune_token_cache(now: float):
+    """清除过期的缓存项，仍然过多时全部清空"""
+    for token in [t for t, (cached_at, _) in _token_cache.items() if now - cached_at >= TOKEN_CACHE_TTL]:
+        del _token_cache[token]
+    if len(_token_cache) >= TOKEN_CACHE_MAX_SIZE:
+        _token_cache.clear()
 
 
 # 更新文件上传信息
@@ -111,7 +539,7 @@ async def update_transfer_file(
     更新传输记录的文件信息
     :return: 是否成功
     """
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _write_transaction() as db:
         cursor = await db.execute("""
             UPDATE transfers
             SET encrypted_file_path = ?,
@@ -120,36 +548,44 @@ async def update_transfer_file(
                 file_size = ?
             WHERE url_token = ?
         """, (encrypted_file_path, encrypted_aes_key, original_filename, file_size, url_token))
-        await db.commit()
-        return cursor.rowcount > 0
+    _invalidate_transfer(url_token)
+    return cursor.rowcount > 0
 
 
-# 更新上传进度
-async def update_upload_progress(url_token: str, chunks_uploaded: int, chunks_total: int) -> bool:
-    """更新分片上传进度"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cursor = await db.execute("""
-            UPDATE transfers
-            SET chunks_uploaded = ?,
-                chunks_total = ?,
-                upload_started_at = COALESCE(upload_started_at, CURRENT_TIMESTAMP)
-            WHERE url_token = ?
-        """, (chunks_uploaded, chunks_total, url_token))
-        await db.commit()
-        return cursor.rowcount > 0
-
+# 完成分片上传
+async def complete_upload(
+        url_token: str,
+        session_key: str,
+        encrypted_file_path: str,
+        encrypted_aes_key: str,
+        original_filename: str,
+        file_size: int
+) -> bool:
+    """
+    在一个事务内完成分片上传：写回最终进度、写入文件信息、标记上传完成、删除上传会话及分片记录
+    :return: 是否成功（传输记录不存在时回滚并返回 False）
+    """
+    progress = _pending_progress.pop(url_token, None)
 
-# 标记上传完成
-async def mark_upload_completed(url_token: str) -> bool:
-    """标记上传完成"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _write_transaction() as db:
+        if progress:
+            await db.execute(_SQL_UPDATE_UPLOAD_PROGRESS, (*progress, url_token))
         cursor = await db.execute("""
             UPDATE transfers
-            SET upload_completed_at = CURRENT_TIMESTAMP
+            SET encrypted_file_path = ?,
+                encrypted_aes_key = ?,
+                original_filename = ?,
+                file_size = ?,
+                upload_completed_at = ?
             WHERE url_token = ?
-        """, (url_token,))
-        await db.commit()
-        return cursor.rowcount > 0
+        """, (encrypted_file_path, encrypted_aes_key, original_filename, file_size, now_us(), url_token))
+        if cursor.rowcount == 0:
+            await db.rollback()
+            return False
+        await db.execute("DELETE FROM upload_chunks WHERE session_key = ?", (session_key,))
+        await db.execute("DELETE FROM upload_sessions WHERE session_key = ?", (session_key,))
+    _invalidate_transfer(url_token)
+    return True
 
 
 # 标记文件已下载
@@ -158,15 +594,15 @@ async def mark_as_downloaded(url_token: str) -> bool:
     标记文件已下载
     :return: 是否成功
     """
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _write_transaction() as db:
         cursor = await db.execute("""
             UPDATE transfers
             SET downloaded = 1,
-                download_at = CURRENT_TIMESTAMP
+                download_at = ?
             WHERE url_token = ?
-        """, (url_token,))
-        await db.commit()
-        return cursor.rowcount > 0
+        """, (now_us(), url_token))
+    _invalidate_transfer(url_token)
+    return cursor.rowcount > 0
 
 
 # 删除传输记录
@@ -175,32 +611,141 @@ async def delete_transfer(url_token: str) -> bool:
     删除传输记录
     :return: 是否成功
     """
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _write_transaction() as db:
         cursor = await db.execute("""
             DELETE FROM transfers WHERE url_token = ?
         """, (url_token,))
-        await db.commit()
-        return cursor.rowcount > 0
+    _invalidate_transfer(url_token)
+    return cursor.rowcount > 0
 
 
-# 获取过期的传输记录
-async def get_expired_transfers() -> list:
+# 清理过期的传输记录
+async def reap_expired() -> list:
     """
-    获取所有过期的传输记录
-    :return: 过期记录列表
+    一条 DELETE ... RETURNING 删除所有已到期的传输记录（一次提交）
+    与到期定时器规则一致：已下载的记录同样保留到 expires_at，供统计使用
+    :return: 被删除的记录 [(url_token, encrypted_file_path), ...]，由调用方删除对应文件
     """
-    # 获取东八区当前时间的 ISO 格式字符串
-    current_time_cst = datetime.now(CST).isoformat()
-
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _write_transaction() as db:
         async with db.execute("""
-            SELECT * FROM transfers
+            DELETE FROM transfers
             WHERE expires_at < ?
-            OR downloaded = 1
-        """, (current_time_cst,)) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+            RETURNING url_token, encrypted_file_path
+        """, (now_us(),)) as cursor:
+            reaped = [(row[0], row[1]) for row in await cursor.fetchall()]
+    for url_token, _ in reaped:
+        _invalidate_transfer(url_token)
+    return reaped
+
+# 获取所有传输的到期时间
+async def get_transfer_expiries() -> list:
+    """
+    获取所有传输记录的到期时间（用于启动时恢复到期定时器）
+    :return: [(url_token, expires_at), ...]，expires_at 为 Unix 微秒
+    """
+    db = get_read_db()
+    async with db.execute("""
+        SELECT url_token, expires_at FROM transfers
+    """) as cursor:
+        return list(await cursor.fetchall())
+
+# ==================== 分片上传会话 ====================
+
+async def record_upload_chunk(session_key: str, url_token: str, chunk_index: int, chunk_path: str,
+                              total_chunks: int, encrypted_aes_key: str, original_filename: str) -> Optional[int]:
+    """
+    在一个事务内记录分片：创建会话（已存在则忽略）、登记分片
+    传输表上的进度只记在内存中，由 _progress_flusher 合并写回
+    :return: 该会话已上传的分片数；传输不存在或已接收过文件时返回 None
+    """
+    now = now_us()
+
+    async with _write_transaction() as db:
+        async with db.execute(_SQL_SELECT_UPLOADABLE, (url_token,)) as cursor:
+            if await cursor.fetchone() is None:
+                return None
+
+        await db.execute(_SQL_INSERT_UPLOAD_SESSION, (
+            session_key, url_token, encrypted_aes_key, original_filename, total_chunks,
+            now, now + _EXPIRATION_US
+        ))
+        await db.execute(_SQL_UPSERT_UPLOAD_CHUNK, (session_key, chunk_index, chunk_path))
+        async with db.execute(_SQL_COUNT_UPLOAD_CHUNKS, (session_key,)) as cursor:
+            uploaded_chunks = (await cursor.fetchone())[0]
+
+    pending = _pending_progress.get(url_token)
+    _pending_progress[url_token] = (uploaded_chunks, total_chunks, pending[2] if pending else now)
+    return uploaded_chunks
+
+
+async def _flush_progress():
+    """把内存中累积的上传进度一次性写回数据库（一个事务内 executemany）"""
+    if not _pending_progress:
+        return
+    rows = [(*progress, url_token) for url_token, progress in _pending_progress.items()]
+    _pending_progress.clear()
+    try:
+        async with _write_transaction() as db:
+            await db.executemany(_SQL_UPDATE_UPLOAD_PROGRESS, rows)
+    except Exception as e:
+        print(f"❌ 上传进度写入失败: {e}")
+
+
+async def _progress_flusher():
+    """后台任务：每 PROGRESS_FLUSH_INTERVAL 秒写回一次上传进度"""
+    while True:
+        await asyncio.sleep(PROGRESS_FLUSH_INTERVAL)
+        await _flush_progress()
+
+
+async def get_upload_session(session_key: str) -> Optional[aiosqlite.Row]:
+    """获取分片上传会话"""
+    db = get_read_db()
+    async with db.execute("""
+        SELECT * FROM upload_sessions WHERE session_key = ?
+    """, (session_key,)) as cursor:
+        return await cursor.fetchone()
+
+
+async def get_upload_chunks(session_key: str) -> Dict[int, str]:
+    """获取会话的所有分片路径 {chunk_index: chunk_path}"""
+    db = get_read_db()
+    async with db.execute("""
+        SELECT chunk_index, chunk_path FROM upload_chunks WHERE session_key = ?
+    """, (session_key,)) as cursor:
+        return {index: path for index, path in await cursor.fetchall()}
+
+
+async def delete_upload_sessions_by_token(url_token: str) -> list:
+    """
+    删除某个传输的所有分片上传会话
+    :return: 被删除的 session_key 列表
+    """
+    async with _write_transaction() as db:
+        async with db.execute("""
+            DELETE FROM upload_sessions WHERE url_token = ? RETURNING session_key
+        """, (url_token,)) as cursor:
+            session_keys = [row[0] for row in await cursor.fetchall()]
+        await db.executemany("""
+            DELETE FROM upload_chunks WHERE session_key = ?
+        """, [(session_key,) for session_key in session_keys])
+    return session_keys
+
+
+async def reap_expired_upload_sessions() -> list:
+    """
+    删除所有过期（未完成）的分片上传会话及其分片记录（一次提交）
+    :return: 被删除的 session_key 列表，由调用方删除分片目录
+    """
+    async with _write_transaction() as db:
+        async with db.execute("""
+            DELETE FROM upload_sessions WHERE expires_at < ? RETURNING session_key
+        """, (now_us(),)) as cursor:
+            session_keys = [row[0] for row in await cursor.fetchall()]
+        await db.executemany("""
+            DELETE FROM upload_chunks WHERE session_key = ?
+        """, [(session_key,) for session_key in session_keys])
+    return session_keys
 
 # ==================== 日志功能 ====================
 
@@ -215,75 +760,96 @@ async def log_action(url_token: str, action: str, details: str = None,
     :param user_agent: 用户代理
     :return: 是否成功
     """
-    current_time_cst = datetime.now(CST).isoformat()
-
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("""
-            INSERT INTO transfer_logs (url_token, action, details, ip_address, user_agent, created_at)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (url_token, action, details, ip_address, user_agent, current_time_cst))
-        await db.commit()
-        return True
+    # 只入队不等待落库，由 _log_writer 批量写入
+    _log_queue.put_nowait((url_token, action, details, ip_address, user_agent, now_us()))
+    if _log_queue.qsize() >= LOG_BATCH_SIZE - 1:
+        _log_batch_ready.set()
+    return True
+
+
+async def _write_logs(rows: list):
+    """批量写入日志（同一个事务内 executemany，一次提交）"""
+    async with _write_transaction() as db:
+        await db.executemany(_SQL_INSERT_LOG, rows)
+
+
+async def _log_writer():
+    """后台任务：每 LOG_FLUSH_INTERVAL 秒或攒满 LOG_BATCH_SIZE 条写入一次日志，收到 None 时退出"""
+    running = True
+    while running:
+        rows = [await _log_queue.get()]
+        if _log_queue.qsize() < LOG_BATCH_SIZE - 1:
+            try:
+                await asyncio.wait_for(_log_batch_ready.wait(), LOG_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+        _log_batch_ready.clear()
+        while len(rows) < LOG_BATCH_SIZE and not _log_queue.empty():
+            rows.append(_log_queue.get_nowait())
+
+        if None in rows:
+            rows = [row for row in rows if row is not None]
+            running = False
+
+        if rows:
+            try:
+                await _write_logs(rows)
+            except Exception as e:
+                print(f"❌ 日志写入失败: {e}")
 
 
 async def get_transfer_logs(url_token: str) -> list:
-    """获取特定传输的所有日志"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("""
-            SELECT * FROM transfer_logs
-            WHERE url_token = ?
-            ORDER BY created_at DESC
-        """, (url_token,)) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    """获取特定传输的所有日志（aiosqlite.Row 列表，由调用方在输出时转换）"""
+    db = get_read_db()
+    async with db.execute("""
+        SELECT * FROM transfer_logs
+        WHERE url_token = ?
+        ORDER BY created_at DESC
+    """, (url_token,)) as cursor:
+        return await cursor.fetchall()
+
+
+async def get_recent_logs(limit: int) -> list:
+    """获取最近的日志（id 是自增 rowid，与写入顺序一致：倒序遍历主键即可，无需先对全表排序）"""
+    db = get_read_db()
+    async with db.execute("""
+        SELECT * FROM transfer_logs
+        ORDER BY id DESC
+        LIMIT ?
+    """, (limit,)) as cursor:
+        return await cursor.fetchall()
 
 
 # ==================== 统计功能 ====================
 
-async def get_statistics() -> Dict:
-    """获取系统统计信息"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # 总传输数
-        async with db.execute("SELECT COUNT(*) FROM transfers") as cursor:
-            total_transfers = (await cursor.fetchone())[0]
-
-        # 已完成传输数
-        async with db.execute("SELECT COUNT(*) FROM transfers WHERE downloaded = 1") as cursor:
-            completed_transfers = (await cursor.fetchone())[0]
+def _today_range():
+    """
+    东八区"今天"的半开区间 [start, end)
+    :return: (start, end)，Unix 微秒
+    """
+    start = datetime.now(CST).replace(hour=0, minute=0, second=0, microsecond=0)
+    start_us = int(start.timestamp()) * 1_000_000
+    return start_us, start_us + 86400 * 1_000_000
 
-        # 待下载传输数
-        async with db.execute("""
-            SELECT COUNT(*) FROM transfers 
-            WHERE encrypted_file_path IS NOT NULL 
-            AND downloaded = 0 
-            AND expires_at > CURRENT_TIMESTAMP
-        """) as cursor:
-            pending_transfers = (await cursor.fetchone())[0]
-
-        # 总文件大小
-        async with db.execute("SELECT COALESCE(SUM(file_size), 0) FROM transfers") as cursor:
-            total_size = (await cursor.fetchone())[0]
-
-        # 今日创建数
-        async with db.execute("""
-            SELECT COUNT(*) FROM transfers 
-            WHERE DATE(created_at) = DATE('now')
-        """) as cursor:
-            today_created = (await cursor.fetchone())[0]
 
-        # 今日下载数
-        async with db.execute("""
-            SELECT COUNT(*) FROM transfers 
-            WHERE DATE(download_at) = DATE('now')
-        """) as cursor:
-            today_downloaded = (await cursor.fetchone())[0]
-
-        return {
-            "total_transfers": total_transfers,
-            "completed_transfers": completed_transfers,
-            "pending_transfers": pending_transfers,
-            "total_size": total_size,
-            "today_created": today_created,
-            "today_downloaded": today_downloaded
-        }
\ No newline at end of file
+async def get_statistics() -> Dict:
+    """获取系统统计信息（一次扫描，条件聚合得出全部指标）"""
+    today_start, today_end = _today_range()
+    db = get_read_db()
+
+    async with db.execute("""
+        SELECT
+            COUNT(*) AS total_transfers,
+            COALESCE(SUM(downloaded = 1), 0) AS completed_transfers,
+            COALESCE(SUM(encrypted_file_path IS NOT NULL AND downloaded = 0 AND expires_at > :now), 0)
+                AS pending_transfers,
+            COALESCE(SUM(file_size), 0) AS total_size,
+            COALESCE(SUM(created_at >= :today_start AND created_at < :today_end), 0) AS today_created,
+            COALESCE(SUM(download_at >= :today_start AND download_at < :today_end), 0) AS today_downloaded
+        FROM transfers
+    """, {
+        "now": now_us(),
+        "today_start": today_start,
+        "today_end": today_end,
+    }) as cursor:
+        return dict(await cursor.fetchone())
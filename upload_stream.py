@@ -0,0 +1,141 @@
+from typing import Callable, Dict, Optional
+from pathlib import Path
+
+import aiofiles
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+
+# 普通表单字段的最大长度（加密后的 AES 密钥、文件名等）
+MAX_FIELD_SIZE = 64 * 1024
+# 请求体中除文件内容外的最大开销（表单字段、multipart 边界与头部）
+MAX_FORM_OVERHEAD = 1024 * 1024
+
+
+class UploadStreamError(Exception):
+    """请求体不是合法的 multipart/form-data"""
+
+
+class StreamingUploadParser:
+    """
+    流式解析 multipart/form-data 请求体：
+    文件字段直接写入目标文件（不经过 SpooledTemporaryFile），普通字段保存在内存
+    """
+
+    def __init__(self, content_type: str, file_field: str,
+                 file_path_factory: Callable[[str], Path], max_file_size: int):
+        """
+        :param content_type: 请求的 Content-Type 头
+        :param file_field: 文件字段名
+        :param file_path_factory: 根据上传文件名返回保存路径
+        :param max_file_size: 文件最大字节数，超过后停止写入
+        """
+        _, params = parse_options_header(content_type)
+        if b"boundary" not in params:
+            raise UploadStreamError("缺少 multipart boundary")
+
+        self.file_field = file_field
+        self.file_path_factory = file_path_factory
+        self.max_file_size = max_file_size
+
+        self.fields: Dict[str, str] = {}
+        self.file_path: Optional[Path] = None
+        self.file_size = 0
+
+        self._parser = MultipartParser(params[b"boundary"], {
+            "on_part_begin": self._on_part_begin,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+        })
+        self._file = None
+        self._pending = []  # 解析回调中收到、尚未写盘的文件数据
+
+        # 当前 part 的状态
+        self._header_field = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._name = None
+        self._is_file = False
+        self._value = bytearray()
+
+    # ---------- multipart 回调（同步，只做内存操作） ----------
+
+    def _on_part_begin(self):
+        self._disposition = b""
+        self._name = None
+        self._is_file = False
+        self._value = bytearray()
+
+    def _on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def _on_header_end(self):
+        if self._header_field.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._disposition)
+        if b"name" not in options:
+            raise UploadStreamError("Content-Disposition 缺少 name")
+
+        self._name = options[b"name"].decode("utf-8", "replace")
+        if b"filename" in options and self._name == self.file_field:
+            if self.file_path is not None:
+                raise UploadStreamError("只允许上传一个文件")
+            self._is_file = True
+            self.file_path = self.file_path_factory(options[b"filename"].decode("utf-8", "replace"))
+
+    def _on_part_data(self, data: bytes, start: int, end: int):
+        if self._is_file:
+            self.file_size += end - start
+            if self.file_size <= self.max_file_size:
+                self._pending.append(data[start:end])
+        elif self._name is not None:
+            self._value += data[start:end]
+            if len(self._value) > MAX_FIELD_SIZE:
+                raise UploadStreamError(f"字段 {self._name} 过长")
+
+    def _on_part_end(self):
+        if not self._is_file and self._name is not None:
+            self.fields[self._name] = self._value.decode("utf-8", "replace")
+
+    # ---------- 异步驱动 ----------
+
+    async def _flush(self):
+        """把回调中积累的文件数据写入磁盘（aiofiles 在线程池中执行）"""
+        if self.file_path is None:
+            return
+        if self._file is None:
+            self._file = await aiofiles.open(self.file_path, "wb")
+        if self._pending:
+            data = b"".join(self._pending)
+            self._pending.clear()
+            await self._file.write(data)
+
+    async def parse(self, stream):
+        """
+        消费请求体流
+        文件超过 max_file_size 时立即停止读取，调用方根据 file_size 判断并清理
+        """
+        try:
+            async for chunk in stream:
+                self._parser.write(chunk)
+                await self._flush()
+                if self.file_size > self.max_file_size:
+                    return
+            self._parser.finalize()
+            await self._flush()
+        except MultipartParseError as e:
+            raise UploadStreamError(str(e))
+        finally:
+            if self._file is not None:
+                await self._file.close()
+                self._file = None